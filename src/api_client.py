@@ -9,12 +9,14 @@ to ensure reliable operation under various conditions.
 """
 
 import time
+import math
 import anthropic
-from anthropic import RateLimitError, APIError
+from anthropic import RateLimitError, APIError, NOT_GIVEN
 import base64
 import json
 import os
 import logging
+import functools
 from PIL import Image
 import pytesseract
 import io
@@ -23,6 +25,34 @@ import textwrap
 import cv2
 import numpy as np
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+# The OCR check is only a quality gate: treat the page as one block of text (--psm 6)
+# to skip Tesseract's page layout analysis, and use the LSTM engine only (--oem 1)
+OCR_QUALITY_CONFIG = '--oem 1 --psm 6'
+
+# The focus and histogram checks only gate quality, so large images (e.g. phone
+# photos) are area-downsampled to this long edge first. It sits above a default
+# 72 dpi page render, so PDF pages are checked at their native resolution
+QUALITY_CHECK_MAX_EDGE = 1024
+
+# A server-requested retry delay is capped like the exponential backoff, so a
+# huge retry-after cannot stall the run while it holds the lock file
+MAX_RETRY_AFTER = 60
+
+try:
+    # orjson is an optional, faster drop-in for decoding API responses
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Supported file extensions and the media type each is processed as
+MEDIA_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.pdf': 'application/pdf',
+}
 
 def check_focus_measure(gray_image):
     """
@@ -49,64 +79,72 @@ def check_histogram_spread(gray_image):
         str: 'Good' if the histogram spread is above the threshold, 'Bad' otherwise.
     """
     # Calculate histogram
-    hist = cv2.calcHist([gray_image], [0], None, [256], [0, 256])
-    # Normalize the histogram
-    hist_norm = hist.ravel() / hist.max()
-    # Calculate the spread using the coefficient of variation
-    hist_spread = np.std(hist_norm) / np.mean(hist_norm)
+    hist = cv2.calcHist([gray_image], [0], None, [256], [0, 256]).ravel()
+    # Calculate the spread using the coefficient of variation; it is scale
+    # invariant, so the histogram does not need normalizing first
+    hist_spread = np.std(hist) / np.mean(hist)
     logging.info(f"Histogram spread: {hist_spread}")
     return 'Good' if hist_spread > 0.5 else 'Bad'  # Threshold can be adjusted
 
-def check_ocr_confidence(image_path):
+def check_ocr_confidence(image):
     """
     Checks the OCR confidence of an image using Tesseract OCR.
 
     Args:
-        image_path (str): Path to the image file.
+        image (Union[numpy.ndarray, str]): Image array, or path to the image file.
 
     Returns:
         str: 'Good' if the average OCR confidence is above the threshold, 'Bad' otherwise.
     """
-    # Load the image with Pillow
-    image = Image.open(image_path)
+    # Use in-memory pixels as-is; only load from disk when given a path
+    image = Image.fromarray(image) if isinstance(image, np.ndarray) else Image.open(image)
     # Perform OCR using Tesseract
-    ocr_result = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-    # Calculate average confidence
-    confidences = [int(conf) for conf in ocr_result['conf'] if conf != '-1']
-    average_confidence = sum(confidences) / len(confidences) if confidences else 0
+    ocr_result = pytesseract.image_to_data(image, config=OCR_QUALITY_CONFIG, output_type=pytesseract.Output.DICT)
+    # Calculate average confidence, ignoring the -1 placeholders of non-word boxes
+    confidences = np.asarray(ocr_result.get('conf', []), dtype=np.float32)
+    confidences = confidences[confidences >= 0]
+    average_confidence = float(confidences.mean()) if confidences.size else 0
     logging.info(f"Average OCR confidence: {average_confidence}")
     return 'Good' if average_confidence >= 10 else 'Bad'  # Threshold can be adjusted
 
-def check_image_quality(image_path):
+def check_image_quality(image):
     """
     Checks the overall quality of an image based on focus measure, histogram spread, and OCR confidence.
 
     Args:
-        image_path (str): Path to the image file.
+        image (Union[numpy.ndarray, str]): RGB or grayscale image array, or path to the image file.
 
     Returns:
         str: 'Good' if all quality measures are above their respective thresholds, 'Bad' otherwise.
     """
-    image = cv2.imread(image_path)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    focus = check_focus_measure(gray)
-    histogram = check_histogram_spread(gray)
-    ocr_confidence = check_ocr_confidence(image_path)
-    
-    results = {
-        "Focus Measure": focus,
-        "Histogram Spread": histogram,
-        "OCR Confidence": ocr_confidence
-    }
+    if isinstance(image, np.ndarray):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    else:
+        gray = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+
+    # Downsample once for both OpenCV checks; Tesseract keeps the full resolution
+    # because shrinking the text would lower its confidence
+    small = gray
+    scale = QUALITY_CHECK_MAX_EDGE / max(gray.shape[:2])
+    if scale < 1:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # Cheapest checks first: stop at the first failure so Tesseract only runs
+    # on images that already passed the OpenCV checks
+    checks = (
+        ("Focus Measure", lambda: check_focus_measure(small)),
+        ("Histogram Spread", lambda: check_histogram_spread(small)),
+        ("OCR Confidence", lambda: check_ocr_confidence(gray)),
+    )
+    results = {}
+    for name, check in checks:
+        results[name] = check()
+        if results[name] == 'Bad':
+            break
     
     logging.info(f"Image quality results: {results}")
     
-    # Combine the results
-    if 'Bad' in results.values():
-        return 'Bad'
-    else:
-        return 'Good'
+    return 'Bad' if 'Bad' in results.values() else 'Good'
 
 def convert_pdf_to_images(pdf_path, save_dir, max_pages=None):
     """
@@ -118,7 +156,7 @@ def convert_pdf_to_images(pdf_path, save_dir, max_pages=None):
         max_pages (int, optional): Maximum number of pages to convert. Defaults to None.
 
     Returns:
-        List[PIL.Image]: A list of PIL Image objects of the converted pages.
+        List[numpy.ndarray]: A list of (height, width, 3) RGB arrays of the converted pages.
     """
     images = []
     try:
@@ -136,12 +174,13 @@ def convert_pdf_to_images(pdf_path, save_dir, max_pages=None):
             for i in range(num_pages):
                 page = doc[i]
                 pix = page.get_pixmap()
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                # pix.samples is already a bytes copy; wrap it as an array instead of copying it again into a PIL image
+                img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)
                 images.append(img)
 
                 # Save images locally
                 image_filename = f"{base_filename}_page_{i+1}.jpeg"
-                img.save(os.path.join(save_subdir, image_filename))
+                save_pixmap_as_jpeg(pix, os.path.join(save_subdir, image_filename))
 
     except Exception as e:
         print(f"Failed to convert PDF to images due to: {str(e)}")
@@ -172,6 +211,18 @@ def encode_image_to_base64(image):
         logging.error(f"Error processing image for conversion to base64: {str(e)}")
         return None
 
+def encode_bytes_to_base64(raw):
+    """
+    Encodes already-encoded image bytes (e.g. JPEG data) to a base64 string.
+
+    Args:
+        raw (bytes): Encoded image data.
+
+    Returns:
+        str: Base64 encoded string of the data.
+    """
+    return base64.b64encode(raw).decode('ascii')
+
 def get_media_type(image_path):
     """
     Determines the media type (MIME type) based on the file extension.
@@ -182,14 +233,7 @@ def get_media_type(image_path):
     Returns:
         str: Media type (e.g., 'image/jpeg', 'image/png', 'application/pdf'), or None if unsupported.
     """
-    if image_path.lower().endswith(('.jpg', '.jpeg')):
-        return 'image/jpeg'
-    elif image_path.lower().endswith('.png'):
-        return 'image/png'
-    elif image_path.lower().endswith('.pdf'):
-        return 'application/pdf'
-    else:
-        return None
+    return MEDIA_TYPES.get(os.path.splitext(image_path)[1].lower())
 
 def save_image_as_jpeg(image, file_path):
     """
@@ -198,11 +242,35 @@ def save_image_as_jpeg(image, file_path):
     Args:
         image (PIL.Image): The image to be saved.
         file_path (str): Full path where the image will be saved.
+
+    Returns:
+        bytes: The encoded JPEG data that was written.
     """
     if image.mode == 'RGBA':
         image = image.convert('RGB')
-    image.save(file_path, format='JPEG')
+    buffered = io.BytesIO()
+    image.save(buffered, format='JPEG')
+    jpeg_bytes = buffered.getvalue()
+    with open(file_path, 'wb') as f:
+        f.write(jpeg_bytes)
+    return jpeg_bytes
+
+def save_pixmap_as_jpeg(pix, file_path, quality=85):
+    """
+    Saves a PyMuPDF Pixmap in JPEG format using MuPDF's own encoder, bypassing Pillow.
 
+    Args:
+        pix (fitz.Pixmap): The rendered page to be saved.
+        file_path (str): Full path where the image will be saved.
+        quality (int, optional): JPEG quality. Defaults to 85.
+
+    Returns:
+        bytes: The encoded JPEG data that was written.
+    """
+    jpeg_bytes = pix.tobytes("jpeg", jpg_quality=quality)
+    with open(file_path, 'wb') as f:
+        f.write(jpeg_bytes)
+    return jpeg_bytes
 
 def exponential_backoff(retry_number):
     """
@@ -212,14 +280,106 @@ def exponential_backoff(retry_number):
         retry_number (int): The current retry attempt number.
 
     Returns:
-        float: The calculated wait time in seconds.
+        int: The calculated wait time in seconds.
     """
-    base_delay = 6   # Initial delay of 1 second
-    factor = 2       # Doubling the wait time with each retry
-    max_delay = 60   # Maximum delay capped at 60 seconds
+    # 6s doubled on each retry (6 << n), capped at 60s from the fourth retry
+    # onwards; the cap is checked first so large retry numbers never shift
+    return 60 if retry_number >= 4 else 6 << retry_number
+
+def _render_page_gray(page):
+    """
+    Renders a PDF page as a single-channel grayscale array.
+
+    The quality checks only look at luminance, so this render carries a third of
+    the samples of an RGB one and skips MuPDF's colour conversion.
+
+    Args:
+        page (fitz.Page): The page to render.
+
+    Returns:
+        Tuple[fitz.Pixmap, numpy.ndarray]: The grayscale pixmap and a (height, width) array over a bytes copy of its samples.
+    """
+    pix = page.get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+    return pix, np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+def _process_pdf_for_api(file_path, save_directory, max_pages):
+    """
+    Checks the first pages of a PDF in grayscale and encodes the ones that pass in colour.
+
+    Every checked page is saved locally; pages that fail are saved from their
+    grayscale render, so only pages sent to the API are rendered in RGB.
+
+    Only a PDF that cannot be opened or rendered is reported as poor quality. Errors
+    from the quality checks or the saves (a missing Tesseract, a full disk) are
+    raised, so the record is marked failed instead of being renamed Unclassified.
+
+    Returns:
+        Union[List[dict], str]: Image blocks for the good pages, or a poor quality marker if none passed.
+    """
+    base_filename = os.path.splitext(os.path.basename(file_path))[0]
+    save_subdir = os.path.join(save_directory, base_filename)  # Create a subdirectory for each PDF
+    os.makedirs(save_subdir, exist_ok=True)
+
+    try:
+        doc = fitz.open(file_path)
+    except Exception as e:
+        logging.error(f"Error opening PDF file {file_path}: {str(e)}")
+        return "Unclassified - Poor image quality"
+
+    image_data = []
+    with doc:
+        try:
+            pages = [doc[i] for i in range(min(len(doc), max_pages))]
+            gray_renders = [_render_page_gray(page) for page in pages]
+        except Exception as e:
+            logging.error(f"Error rendering PDF file {file_path}: {str(e)}")
+            return "Unclassified - Poor image quality"
 
-    wait_time = min(max_delay, base_delay * (factor ** retry_number))
-    return wait_time
+        # Pages are checked in memory; OpenCV and Tesseract release the GIL, so pages
+        # can be checked in parallel threads
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+            qualities = list(executor.map(check_image_quality, (gray for _, gray in gray_renders)))
+
+        for i, (page, (gray_pix, _), quality) in enumerate(zip(pages, gray_renders, qualities)):
+            image_path = os.path.join(save_subdir, f"{base_filename}_page_{i+1}.jpeg")
+            if quality == 'Bad':
+                logging.warning(f"Low quality PDF page found, this page will not be sent to the API")
+                save_pixmap_as_jpeg(gray_pix, image_path)
+            else:
+                jpeg_bytes = save_pixmap_as_jpeg(page.get_pixmap(), image_path)
+                image_data.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encode_bytes_to_base64(jpeg_bytes)}})
+
+    if not image_data:
+        return "Unclassified - Poor image quality"
+    return image_data
+
+def _process_image_for_api(file_path, save_directory, max_pages):
+    """
+    Saves an image as JPEG and encodes it if it passes the quality checks.
+
+    Returns:
+        Union[List[dict], str]: A single image block, a poor quality marker, or an empty list on error.
+    """
+    try:
+        final_image_path = os.path.join(save_directory, os.path.basename(file_path))
+        with Image.open(file_path) as img:
+            rgb_image = img.convert('RGB')
+        jpeg_bytes = save_image_as_jpeg(rgb_image, final_image_path)
+        quality = check_image_quality(np.asarray(rgb_image))
+        if quality == 'Bad':
+            return "Unclassified - Poor image quality"
+        else:
+            return [{"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encode_bytes_to_base64(jpeg_bytes)}}]
+    except Exception as e:
+        logging.error(f"Error processing image file {file_path}: {str(e)}")
+        return []
+
+# Handler for each supported media type (see MEDIA_TYPES)
+_MEDIA_HANDLERS = {
+    'application/pdf': _process_pdf_for_api,
+    'image/jpeg': _process_image_for_api,
+    'image/png': _process_image_for_api,
+}
 
 def process_file_for_api(file_path, save_directory):
     """
@@ -234,62 +394,42 @@ def process_file_for_api(file_path, save_directory):
                                 or a string indicating poor image quality or an empty list if processing fails.
     """
     logging.info(f"Start processing file: {os.path.basename(file_path)}")
-    media_type = get_media_type(file_path)
     max_pages = 4  # Limit to the first 4 images for processing
 
-    if media_type == 'application/pdf':
-        images = convert_pdf_to_images(file_path, save_directory, max_pages)
-        images = images[:max_pages]
-        image_data = []
-        poor_quality_count = 0  # To track how many images are classified as poor quality
+    handler = _MEDIA_HANDLERS.get(get_media_type(file_path))
+    if handler is None:
+        logging.warning(f"Unsupported file type for API processing: {file_path}")
+        return []
+    return handler(file_path, save_directory, max_pages)
 
-        for index, image in enumerate(images):
-            final_image_path = os.path.join(save_directory, f"temp_image_{index}.jpeg")
-            save_image_as_jpeg(image, final_image_path)
-            quality = check_image_quality(final_image_path)
-            if quality == 'Bad':
-                logging.warning(f"Low quality PDF page found, this page will not be sent to the API")
-                poor_quality_count += 1
-            else:
-                image_data.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encode_image_to_base64(image)}})
 
-        if poor_quality_count == len(images):
-            return "Unclassified - Poor image quality"
-        return image_data
+@functools.lru_cache(maxsize=None)
+def get_anthropic_client():
+    """
+    Returns the process-wide Anthropic client, creating it on first use.
 
-    elif media_type in ['image/jpeg', 'image/png']:
-        try:
-            final_image_path = os.path.join(save_directory, os.path.basename(file_path))
-            with Image.open(file_path) as img:
-                save_image_as_jpeg(img, final_image_path)
-            quality = check_image_quality(final_image_path)
-            if quality == 'Bad':
-                return "Unclassified - Poor image quality"
-            else:
-                with Image.open(final_image_path) as saved_img:
-                    return [{"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": encode_image_to_base64(saved_img)}}]
-        except Exception as e:
-            logging.error(f"Error processing image file {file_path}: {str(e)}")
-            return []
-    else:
-        logging.warning(f"Unsupported file type for API processing: {file_path}")
-        return []
+    Reusing one client keeps its HTTP connection pool and TLS session alive
+    across API calls instead of rebuilding them for every file.
 
+    Returns:
+        anthropic.Anthropic: The shared API client.
+    """
+    return anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
-def communicate_with_api(image_data, retry_limit=5):
+def communicate_with_api(image_data, retry_limit=5, timeout=NOT_GIVEN):
     """
     Communicates with an external API to classify images, handling retries and rate limits.
 
     Args:
         image_data (list): Encoded image data ready for API submission.
         retry_limit (int): Maximum number of retry attempts in case of API errors.
+        timeout (float, optional): Per-request timeout in seconds, passed to the SDK. Defaults to the client's own timeout.
 
     Returns:
         Tuple[str, str]: A tuple containing the classification result and API response,
                          or None and an error message if communication fails.
     """
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    client = anthropic.Anthropic(api_key=api_key)
+    client = get_anthropic_client()
     user_prompt = create_api_prompt()
 
     for attempt in range(retry_limit):
@@ -302,11 +442,13 @@ def communicate_with_api(image_data, retry_limit=5):
                 messages=[{
                     "role": "user",
                     "content": [{"type": "text", "text": user_prompt}] + image_data
-                }]
+                }],
+                timeout=timeout
             )
             # Log the full response object to inspect its structure
-            logging.info(f"API response received: {response.model_dump_json()}")  # Log the parsed JSON response
-            return parse_api_response(response.model_dump_json())  # Assume response.json() returns a dictionary
+            response_json = response.model_dump_json()  # Serialize once for both logging and parsing
+            logging.info(f"API response received: {response_json}")
+            return parse_api_response(response_json)
         except (RateLimitError, APIError) as e:
             if not handle_api_error(e, attempt):
                 return None, "API communication failed after maximum retries"
@@ -341,9 +483,32 @@ def classify_file(file_path):
     else:
         return None, "API communication failed or no valid response"
 
+def get_retry_after(e):
+    """
+    Reads the server's requested delay from the retry-after header of an API error.
+
+    Args:
+        e (Exception): The exception object representing the API error.
+
+    Returns:
+        float: The delay in seconds, clamped to 0..MAX_RETRY_AFTER, or None if
+               the error carries no usable header.
+    """
+    headers = getattr(getattr(e, 'response', None), 'headers', None)
+    try:
+        retry_after = float(headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if math.isnan(retry_after):
+        return None
+    return min(max(retry_after, 0), MAX_RETRY_AFTER)
+
 def handle_api_error(e, attempt):
     """
-    Handles API errors by applying exponential backoff and logging the error.
+    Handles API errors by waiting before the next attempt and logging the error.
+
+    The wait honours the server's retry-after header when present, and falls
+    back to exponential backoff otherwise.
 
     Args:
         e (Exception): The exception object representing the API error.
@@ -352,7 +517,8 @@ def handle_api_error(e, attempt):
     Returns:
         bool: True if retrying should continue, False if the maximum number of retries is reached.
     """
-    wait_time = exponential_backoff(attempt)
+    retry_after = get_retry_after(e)
+    wait_time = exponential_backoff(attempt) if retry_after is None else retry_after
     logging.error(f"Error communicating with API on attempt {attempt + 1}: {str(e)}")
     time.sleep(wait_time)
     if attempt >= 4:  # Last attempt
@@ -373,7 +539,7 @@ def parse_api_response(response_data):
     try:
         if isinstance(response_data, str):
             logging.info(f"Response data is string. Attempting to load as JSON: {response_data}")
-            response_data = json.loads(response_data)
+            response_data = json_loads(response_data)
 
         if 'content' in response_data and isinstance(response_data['content'], list) and response_data['content']:
             content_text = response_data['content'][0].get('text', '')
@@ -381,7 +547,7 @@ def parse_api_response(response_data):
             # Preprocess the content_text to remove any unwanted control characters
             clean_content_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', content_text)
             # Now attempt to load the cleaned text as JSON
-            content_data = json.loads(clean_content_text)
+            content_data = json_loads(clean_content_text)
             logging.info(f"Extracted ContentType: {content_data.get('ContentType')}")
             return content_data.get('ContentType'), json.dumps(content_data)
         return None, "Content field missing or improperly formatted"
@@ -6,90 +6,114 @@ It supports file management tasks within the application by offering functionali
 and verify their locations.
 """
 import os
+import re
+import glob
+import fnmatch
+import functools
 import logging
-import subprocess
 import time
 
-def find_file_path(deal_name: str, file_name: str, max_retries: int = 3, initial_delay: int = 10) -> str | None:
+DEALS_PATH = r"Z:\Zoho CRM\Deals"
+ACCOUNTS_PATH = r"Z:\Zoho CRM\Accounts"
+
+INVALID_FILENAME_CHARS = '<>:"/\\|?*'
+_INVALID_FILENAME_RE = re.compile(f"[{re.escape(INVALID_FILENAME_CHARS)}]")
+
+def _search_folder(file_name, folder_path):
+    """
+    Looks for a file directly inside a folder.
+
+    An exact name match wins; otherwise ':' is treated as a single-character
+    wildcard (it cannot appear in Windows filenames) and the most recently
+    modified matching file is returned.
+
+    Args:
+        file_name: Name of the file to find
+        folder_path: Folder to look in
+
+    Returns:
+        str: Full file path if found, None otherwise
+    """
+    if not os.path.isdir(folder_path):
+        return None
+
+    exact_path = os.path.join(folder_path, file_name)
+    if os.path.isfile(exact_path):
+        return exact_path
+
+    pattern = os.path.normcase(glob.escape(file_name).replace(':', '?'))
+    best_entry = None
+    best_mtime = None
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file() and fnmatch.fnmatchcase(os.path.normcase(entry.name), pattern):
+                mtime = entry.stat().st_mtime
+                if best_mtime is None or mtime > best_mtime:
+                    best_entry, best_mtime = entry.path, mtime
+    return best_entry
+
+@functools.lru_cache(maxsize=1024)
+def _find_deal_folders(deal_name, deals_path, accounts_path):
+    """
+    Resolves the existing folders a deal's files can live in, in search order: the
+    deal's own folder under the deals share, then each account's 'Associated Deals' copy.
+
+    Resolving a deal means scanning every account on the share, so the result is
+    cached; several files of the same deal are usually looked up in one run.
+
+    Returns:
+        tuple: Existing folder paths for the deal
+    """
+    folders = [os.path.join(deals_path, deal_name)]
+    if os.path.isdir(accounts_path):
+        with os.scandir(accounts_path) as companies:
+            folders.extend(
+                os.path.join(company.path, "Associated Deals", deal_name)
+                for company in companies if company.is_dir()
+            )
+    return tuple(folder for folder in folders if os.path.isdir(folder))
+
+def find_file_path(deal_name: str, file_name: str, max_retries: int = 3, initial_delay: int = 10,
+                   deals_path: str = DEALS_PATH, accounts_path: str = ACCOUNTS_PATH) -> str | None:
     """
-    Finds the current file path using PowerShell script.
+    Finds the current file path by searching the deal folders on the file share.
 
     Args:
         deal_name: Name of the deal folder
         file_name: Name of the file to find
         max_retries: Number of retries if file not found
         initial_delay: Initial delay in seconds between retries
+        deals_path: Root folder holding one folder per deal
+        accounts_path: Root folder holding one folder per account
 
     Returns:
         str: Full file path if found, None if not found
     """
-    script_path = os.path.join('tools', 'findFilepath.ps1')
-    
-    # Handle special characters in parameters
-    escaped_file_name = f'"{file_name.replace('"', '`"')}"'
-    escaped_deal_name = f'"{deal_name.replace('"', '`"')}"'
-    
-    ps_command = [
-        'powershell.exe',
-        '-NoProfile',
-        '-NonInteractive',
-        '-ExecutionPolicy', 'Bypass',
-        '-Command',
-        f'& "{script_path}" -FileName {escaped_file_name} -FolderName {escaped_deal_name}'
-    ]
-
     logging.info(f"Searching for file: {file_name} in folder: {deal_name}")
 
     for attempt in range(max_retries):
         try:
             if attempt > 0:
                 logging.info(f"Retry attempt {attempt + 1}/{max_retries}")
-                
-            result = subprocess.run(
-                ps_command,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='replace'
-            )
+                # Folders may have appeared on the share since the last attempt
+                _find_deal_folders.cache_clear()
+
+            for folder_path in _find_deal_folders(deal_name, deals_path, accounts_path):
+                path = _search_folder(file_name, folder_path)
+                if path:
+                    logging.info(f"Found file: {path}")
+                    return path
+
+            logging.info("File not found in specified locations")
 
-            # Log PowerShell errors if any
-            if result.stderr:
-                logging.error(f"PowerShell error: {result.stderr}")
-
-            # Check for PowerShell execution success
-            if result.returncode != 0:
-                logging.error(f"PowerShell execution failed with return code: {result.returncode}")
-                if attempt < max_retries - 1:
-                    time.sleep(initial_delay * (attempt + 1))
-                    continue
-                return None
-
-            # Process the output
-            if result.stdout:
-                for line in result.stdout.splitlines():
-                    if line.startswith("RESULT:"):
-                        path = line.split("RESULT:", 1)[1].strip()
-                        if path == "NOT_FOUND":
-                            logging.info("File not found in specified locations")
-                            break
-                        if os.path.exists(path):
-                            logging.info(f"Found file: {path}")
-                            return path
-                        else:
-                            logging.error(f"Found path doesn't exist: {path}")
-
-            if attempt < max_retries - 1:
-                delay = initial_delay * (attempt + 1)
-                logging.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-
-        except Exception as e:
+        except OSError as e:
+            # The share is a network drive, so treat I/O errors as transient
             logging.error(f"Error during file search: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(initial_delay * (attempt + 1))
-                continue
-            return None
+
+        if attempt < max_retries - 1:
+            delay = initial_delay * (attempt + 1)
+            logging.info(f"Retrying in {delay} seconds...")
+            time.sleep(delay)
 
     logging.error(f"Failed to find file after {max_retries} attempts")
     return None
@@ -106,18 +130,34 @@ def rename_file(original_path, new_name):
         tuple: (bool, str) - (Success status, new path if successful or error message if failed)
     """
     try:
-        directory, _ = os.path.split(original_path)
-        _, extension = os.path.splitext(original_path)
+        directory = os.path.dirname(original_path)
+        extension = os.path.splitext(original_path)[1]
         new_base_name = new_name  # Use classification directly as the new name
+
         new_path = os.path.join(directory, f"{new_base_name}{extension}")
         counter = 1
 
-        # Handle duplicate filenames by appending a counter
-        while os.path.exists(new_path):
-            new_path = os.path.join(directory, f"{new_base_name} ({counter}){extension}")
-            counter += 1
+        # Claim the target name with an exclusive create, so a file that appears
+        # between the check and the rename can never be overwritten; on a
+        # collision move on to the next counter
+        while True:
+            try:
+                os.close(os.open(new_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                new_path = os.path.join(directory, f"{new_base_name} ({counter}){extension}")
+                counter += 1
 
-        os.rename(original_path, new_path)
+        try:
+            # Only the empty placeholder claimed above is replaced
+            os.replace(original_path, new_path)
+        except OSError:
+            # A failed cleanup is only logged, so the caller still sees why the move failed
+            try:
+                os.remove(new_path)
+            except OSError as cleanup_error:
+                logging.error(f"Could not remove placeholder {new_path}: {str(cleanup_error)}")
+            raise
         logging.info(f"File renamed: {new_path}")
         return True, new_path
 
@@ -150,9 +190,8 @@ def validate_new_filename(filename):
             return False, "Filename is too long"
             
         # Check for invalid characters
-        invalid_chars = '<>:"/\\|?*'
-        if any(char in filename for char in invalid_chars):
-            return False, f"Filename contains invalid characters: {invalid_chars}"
+        if _INVALID_FILENAME_RE.search(filename):
+            return False, f"Filename contains invalid characters: {INVALID_FILENAME_CHARS}"
             
         # Must have an extension
         if '.' not in filename:
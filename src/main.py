@@ -6,6 +6,7 @@ for reprocessing by ContractScanner_MMBB. This script handles database interacti
 file renaming, and status updates while maintaining consistent logging and error handling.
 """
 import os
+import argparse
 import logging
 from datetime import datetime
 import time
@@ -24,6 +25,23 @@ from .api_client import classify_file
 # Global lock for thread safety
 lock = threading.Lock()
 
+ALLOWED_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.pdf'})
+VALID_CLASSIFICATIONS = frozenset({
+    'Rental_Contract', 'Mortgage_Contract', 'Contract_Payment',
+    'Teleworking_Agreement', 'Repayment_Table', 'Unclassified', 'Telework_Agreement', 'Homecostrenewal'
+})
+NON_MODIFIABLE_FILES = (
+    "housingrefundrequest",
+    "housingcostrefundrequest",
+    "housingrefundmodification",
+    "yearrenewal",
+    "mmbbform"
+)
+# Where page images are saved while a file is classified
+SAVED_IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "saved_images")
+# Lowercased once at import; a tuple iterates faster than a set for the substring scans below
+_CLASSIFICATIONS_LOWER = tuple(classification.lower() for classification in VALID_CLASSIFICATIONS)
+
 class LockError(Exception):
     pass
 
@@ -79,58 +97,48 @@ def setup_logging(log_directory):
     
     logging.info(f"New logging session started at {datetime.now()}")
 
-def process_failed_record(conn, record):
+def process_failed_record(conn, record, batch_timestamp=None, cursor=None):
     """
     Processes a single failed record, attempting to classify and rename it.
+
+    batch_timestamp is written as last_updated so every record of a run
+    shares one timestamp; it defaults to the time of each update. An open
+    cursor can be passed to reuse one statement handle across the batch.
     """
     try:
         logging.info(f"Processing record {record.contract_payments_id}")
 
-        # Step 1: Define constants
-        allowed_extensions = {'.png', '.jpg', '.jpeg', '.pdf'}
-        valid_classifications = {
-            'Rental_Contract', 'Mortgage_Contract', 'Contract_Payment',
-            'Teleworking_Agreement', 'Repayment_Table', 'Unclassified', 'Telework_Agreement', 'Homecostrenewal'
-        }
-        non_modifiable_files = [
-        "housingrefundrequest",
-        "housingcostrefundrequest",
-        "housingrefundmodification",
-        "yearrenewal",
-        "mmbbform"
-        ]
-
-        # Step 2: Basic file validation
+        # Step 1: Basic file validation
         file_name = record.file_name
-        extension = os.path.splitext(file_name)[1].lower()
+        file_name_lower = file_name.lower()
+        extension = os.path.splitext(file_name_lower)[1]
         
-        # Step 3: Check if file has valid extension
-        if extension not in allowed_extensions:
+        # Step 2: Check if file has valid extension
+        if extension not in ALLOWED_EXTENSIONS:
             error_msg = "Unsupported file type"
             logging.info(f"Skipping {file_name}: {error_msg}")
-            update_rename_failed(conn, record.contract_payments_id, error_msg)
+            update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
             return
 
-        # Step 4: Check if file is non-modifiable - using original logic
-        normalized_filename = file_name.lower().replace("_", "").replace(" ", "")
-        is_non_modifiable = any(non_modifiable_file.lower() in normalized_filename 
-                               for non_modifiable_file in non_modifiable_files)
+        # Step 3: Check if file is non-modifiable - using original logic
+        normalized_filename = file_name_lower.replace("_", "").replace(" ", "")
+        is_non_modifiable = any(non_modifiable_file in normalized_filename 
+                               for non_modifiable_file in NON_MODIFIABLE_FILES)
         
         if is_non_modifiable:
             error_msg = "Not allowed to change - protected filename"
             logging.info(f"Skipping {file_name}: {error_msg}")
-            update_rename_failed(conn, record.contract_payments_id, error_msg)
+            update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
             return
 
-        # Step 5: Check if already classified
-        if any(classification.lower() in file_name.lower() 
-               for classification in valid_classifications):
+        # Step 4: Check if already classified
+        if any(classification in file_name_lower for classification in _CLASSIFICATIONS_LOWER):
             error_msg = "Already classified"
             logging.info(f"Skipping {file_name}: {error_msg}")
-            update_rename_failed(conn, record.contract_payments_id, error_msg)
+            update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
             return
 
-        # Step 6: Verify file location
+        # Step 5: Verify file location
         current_path = record.full_file_path
         if not os.path.exists(current_path):
             logging.info(f"File not found at {current_path}, searching for new location...")
@@ -138,46 +146,62 @@ def process_failed_record(conn, record):
             if not found_path:
                 error_msg = "File not found in any location"
                 logging.error(error_msg)
-                update_rename_failed(conn, record.contract_payments_id, error_msg)
+                update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
                 return
             current_path = found_path
 
-        # Step 7: Process file through Claude API
-        save_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
-                                    "..", "data", "saved_images")
-        os.makedirs(save_directory, exist_ok=True)
+        # Step 6: Process file through Claude API
+        os.makedirs(SAVED_IMAGES_DIR, exist_ok=True)
         
         logging.info(f"Classifying file: {current_path}")
         classification_result, api_response = classify_file(current_path)
         
-        # Step 8: Handle classification results
+        # Step 7: Handle classification results
         if classification_result == "Unclassified - Poor image quality":
             logging.info(f"File {file_name} classified as Unclassified due to poor image quality.")
             classification_result = "Unclassified"
-        elif not classification_result or classification_result not in valid_classifications:
+        elif not classification_result or classification_result not in VALID_CLASSIFICATIONS:
             error_msg = f"Invalid or no classification received: {api_response}"
             logging.error(f"Skipping {file_name}: {error_msg}")
-            update_rename_failed(conn, record.contract_payments_id, error_msg)
+            update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
             return
 
         logging.info(f"File classified as: {classification_result}")
 
-        # Step 9: Rename file using classification
+        # Step 8: Rename file using classification
         success, result = rename_file(current_path, classification_result)
         if success:
             new_filename = os.path.basename(result)
-            update_renamed_record(conn, record.contract_payments_id, new_filename, result)
+            update_renamed_record(conn, record.contract_payments_id, new_filename, result, batch_timestamp, cursor)
             logging.info(f"Successfully processed record {record.contract_payments_id}")
         else:
-            update_rename_failed(conn, record.contract_payments_id, result)
+            update_rename_failed(conn, record.contract_payments_id, result, batch_timestamp, cursor)
             logging.error(f"Failed to rename file for record {record.contract_payments_id}: {result}")
 
     except Exception as e:
         error_msg = str(e)
         logging.error(f"Error processing record {record.contract_payments_id}: {error_msg}")
-        update_rename_failed(conn, record.contract_payments_id, error_msg)
+        update_rename_failed(conn, record.contract_payments_id, error_msg, batch_timestamp, cursor)
+
+def _positive_int(value):
+    """
+    argparse type for counts that must be at least 1; TOP (0) would silently process nothing.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def parse_args(argv=None):
+    """
+    Parses command-line options so the tool can run unattended from a scheduler.
+    """
+    parser = argparse.ArgumentParser(description="Classify and rename failed contract payment files.")
+    parser.add_argument('--batch-size', type=_positive_int, default=50,
+                        help="Maximum number of failed records to process in this run (default: 50)")
+    return parser.parse_args(argv)
 
-def main(lock_file='doc_classification.lock'):
+def main(lock_file='doc_classification.lock', batch_size=50):
     """
     Main function that orchestrates the file renaming process.
     """
@@ -191,7 +215,7 @@ def main(lock_file='doc_classification.lock'):
         
         conn = connect_to_azure_db(config)
         try:
-            failed_records = get_failed_unprocessed_records(conn)
+            failed_records = get_failed_unprocessed_records(conn, batch_size=batch_size)
             
             if not failed_records:
                 logging.info("No failed records to process.")
@@ -199,9 +223,14 @@ def main(lock_file='doc_classification.lock'):
                 
             logging.info(f"Found {len(failed_records)} failed records to process.")
             
-            for record in failed_records:
-                process_failed_record(conn, record)
-                time.sleep(1)  # Small delay between records
+            batch_timestamp = datetime.now()
+            cursor = conn.cursor()
+            try:
+                for record in failed_records:
+                    process_failed_record(conn, record, batch_timestamp, cursor)
+                    time.sleep(1)  # Small delay between records
+            finally:
+                cursor.close()
                 
         finally:
             conn.close()
@@ -216,4 +245,5 @@ def main(lock_file='doc_classification.lock'):
         release_lock(lock_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    main(batch_size=args.batch_size)
\ No newline at end of file
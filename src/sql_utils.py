@@ -1,16 +1,26 @@
 import logging
-from azure.identity import DefaultAzureCredential
 import pyodbc
 from datetime import datetime
 
+# Column sets are fixed, so the UPDATE statements are built once at import time
+_SQL_UPDATE_RENAMED = (
+    "UPDATE contract_payments SET file_name = ?, full_file_path = ?, status = ?, "
+    "has_been_renamed = ?, last_updated = ?, failure_reason = ? "
+    "WHERE contract_payments_id = ?"
+)
+_SQL_UPDATE_RENAME_FAILED = (
+    "UPDATE contract_payments SET has_been_renamed = ?, last_updated = ?, failure_reason = ? "
+    "WHERE contract_payments_id = ?"
+)
+
 def connect_to_azure_db(config):
     """
     Establishes connection to Azure SQL database using managed identity.
+
+    The ODBC driver authenticates itself through ActiveDirectoryMsi, so no
+    separate token has to be fetched (and no credential chain probed) here.
     """
     try:
-        credential = DefaultAzureCredential()
-        token = credential.get_token("https://database.windows.net/.default")
-        
         conn_str = (
             f'Driver={{ODBC Driver 18 for SQL Server}};'
             f'Server=tcp:{config["azure_sql_server"]}.database.windows.net,1433;'
@@ -31,20 +41,27 @@ def connect_to_azure_db(config):
         logging.error(f"Unexpected error: {str(e)}")
         raise
 
-def get_failed_unprocessed_records(conn):
+def get_failed_unprocessed_records(conn, batch_size=50):
     """
     Retrieves records that failed due to file pattern issues and haven't been renamed.
     
     Args:
         conn: Database connection object
+        batch_size: Maximum number of records to fetch
     
     Returns:
-        List of records with status 'Failed' and has_been_renamed = false
+        List of records with status 'Failed' and has_been_renamed = false,
+        limited to the columns needed to classify and rename the file
     """
     cursor = conn.cursor()
     try:
         cursor.execute("""
-            SELECT TOP 50 *
+            SELECT TOP (?)
+                contract_payments_id,
+                deal_id,
+                deal_name,
+                file_name,
+                full_file_path
             FROM contract_payments
             WHERE status = 'Failed'
             AND has_been_renamed = 0
@@ -55,13 +72,13 @@ def get_failed_unprocessed_records(conn):
                 OR deal_name LIKE '% - Home Mortgage Interest'
             )
             ORDER BY contract_payments_id
-        """)
+        """, (batch_size,))
         logging.info("Fetching failed records with housing-related deal patterns")
         return cursor.fetchall()
     finally:
         cursor.close()
 
-def update_renamed_record(conn, payment_id, new_file_name, new_file_path):
+def update_renamed_record(conn, payment_id, new_file_name, new_file_path, last_updated=None, cursor=None):
     """
     Updates a record after successful file renaming.
     
@@ -70,28 +87,25 @@ def update_renamed_record(conn, payment_id, new_file_name, new_file_path):
         payment_id: ID of the payment record
         new_file_name: New name of the file
         new_file_path: New full path of the file
+        last_updated: Timestamp to record, defaults to the current time
+        cursor: Open cursor to reuse across a batch; a new one is opened and closed if omitted
     """
-    cursor = None
+    owns_cursor = cursor is None
     try:
-        cursor = conn.cursor()
-        
-        update_fields = {
-            'file_name': new_file_name,
-            'full_file_path': new_file_path,
-            'status': 'New',  # Reset to New for ContractScanner to process
-            'has_been_renamed': True,
-            'last_updated': datetime.now(),
-            'failure_reason': None  # Clear the failure reason
-        }
+        if owns_cursor:
+            cursor = conn.cursor()
         
-        # Construct the SQL query using parameterization
-        fields = ', '.join([f"{k} = ?" for k in update_fields.keys()])
-        sql = f"UPDATE contract_payments SET {fields} WHERE contract_payments_id = ?"
-        
-        # Prepare the values for the SQL query
-        values = list(update_fields.values()) + [payment_id]
+        values = (
+            new_file_name,
+            new_file_path,
+            'New',  # Reset to New for ContractScanner to process
+            True,
+            last_updated or datetime.now(),
+            None,  # Clear the failure reason
+            payment_id
+        )
         
-        cursor.execute(sql, values)
+        cursor.execute(_SQL_UPDATE_RENAMED, values)
         conn.commit()
         logging.info(f"Successfully updated renamed record {payment_id} with new file name: {new_file_name}")
     
@@ -107,16 +121,17 @@ def update_renamed_record(conn, payment_id, new_file_name, new_file_path):
         raise
     
     finally:
-        if cursor:
+        if owns_cursor and cursor:
             cursor.close()
 
-def update_rename_failed(conn, payment_id, error_message):
+def update_rename_failed(conn, payment_id, error_message, last_updated=None, cursor=None):
     """
     Updates a record when renaming operation fails.
     """
-    cursor = None
+    owns_cursor = cursor is None
     try:
-        cursor = conn.cursor()
+        if owns_cursor:
+            cursor = conn.cursor()
         
         # Add check for empty error message
         if not error_message or error_message.strip() == "":
@@ -124,18 +139,9 @@ def update_rename_failed(conn, payment_id, error_message):
             
         final_message = f"Classification status: {error_message}"
         
-        update_fields = {
-            'has_been_renamed': True,
-            'last_updated': datetime.now(),
-            'failure_reason': final_message
-        }
-        
-        fields = ', '.join([f"{k} = ?" for k in update_fields.keys()])
-        sql = f"UPDATE contract_payments SET {fields} WHERE contract_payments_id = ?"
+        values = (True, last_updated or datetime.now(), final_message, payment_id)
         
-        values = list(update_fields.values()) + [payment_id]
-        
-        cursor.execute(sql, values)
+        cursor.execute(_SQL_UPDATE_RENAME_FAILED, values)
         conn.commit()
         logging.info(f"Updated failure reason for record {payment_id}")
         
@@ -144,7 +150,7 @@ def update_rename_failed(conn, payment_id, error_message):
         logging.error(f"Error updating rename failure for record {payment_id}: {str(e)}")
         raise
     finally:
-        if cursor:
+        if owns_cursor and cursor:
             cursor.close()
 
 def check_duplicate_filename(conn, new_file_name, deal_id):
@@ -162,14 +168,16 @@ def check_duplicate_filename(conn, new_file_name, deal_id):
     cursor = None
     try:
         cursor = conn.cursor()
+        # EXISTS stops at the first match and returns a single value, unlike COUNT(*)
         cursor.execute("""
-            SELECT COUNT(*)
-            FROM contract_payments
-            WHERE file_name = ? AND deal_id = ?
+            SELECT CASE WHEN EXISTS (
+                SELECT 1
+                FROM contract_payments
+                WHERE file_name = ? AND deal_id = ?
+            ) THEN 1 ELSE 0 END
         """, (new_file_name, deal_id))
         
-        count = cursor.fetchone()[0]
-        return count > 0
+        return cursor.fetchval() == 1
     
     finally:
         if cursor:
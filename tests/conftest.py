@@ -2,8 +2,14 @@ import pytest
 import os
 import tempfile
 import json
+import logging
 from unittest.mock import Mock
 
+# The pyodbc connection and cursor surface the code uses. Specced mocks reject
+# anything else instead of growing a child Mock for every attribute touched
+DB_CONNECTION_SPEC = ['cursor', 'commit', 'rollback', 'close']
+DB_CURSOR_SPEC = ['execute', 'fetchone', 'fetchall', 'fetchval', 'close']
+
 @pytest.fixture
 def mock_config():
     return {
@@ -19,8 +25,8 @@ def temp_test_dir():
 
 @pytest.fixture
 def mock_db_connection():
-    conn = Mock()
-    cursor = Mock()
+    conn = Mock(spec=DB_CONNECTION_SPEC)
+    cursor = Mock(spec=DB_CURSOR_SPEC)
     conn.cursor.return_value = cursor
     return conn
 
@@ -79,6 +85,23 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "integration: mark test as integration test")
     config.addinivalue_line("markers", "no_db: mark test as not using database")
 
+@pytest.fixture(autouse=True)
+def _reset_logging():
+    """Removes the root handlers a test installed through setup_logging, and restores the level.
+
+    Left in place they pile up across tests, so every later log call is written once
+    per handler, and each FileHandler keeps its log file open. pytest's own capture
+    handlers are subclasses, so matching on the exact types leaves them alone.
+    """
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    yield
+    for handler in root_logger.handlers[:]:
+        if type(handler) in (logging.FileHandler, logging.StreamHandler):
+            root_logger.removeHandler(handler)
+            handler.close()
+    root_logger.setLevel(level)
+
 @pytest.fixture(scope="function")
 def test_db():
     """Create a test database connection with mocked data."""
@@ -9,6 +9,8 @@ from unittest.mock import Mock, patch, MagicMock
 import anthropic
 from anthropic import APIStatusError, RateLimitError, APIError
 import io
+import fitz
+import pytesseract
 
 from src.api_client import (
     check_focus_measure,
@@ -17,14 +19,26 @@ from src.api_client import (
     check_image_quality,
     convert_pdf_to_images,
     encode_image_to_base64,
+    encode_bytes_to_base64,
     get_media_type,
     save_image_as_jpeg,
+    save_pixmap_as_jpeg,
     exponential_backoff,
     process_file_for_api,
+    classify_file,
     communicate_with_api,
+    get_anthropic_client,
+    handle_api_error,
     parse_api_response
 )
 
+@pytest.fixture(autouse=True)
+def reset_anthropic_client():
+    """Drop the cached API client so each test builds it from its own patch."""
+    get_anthropic_client.cache_clear()
+    yield
+    get_anthropic_client.cache_clear()
+
 @pytest.fixture
 def sample_image():
     """Create a sample grayscale image for testing."""
@@ -50,6 +64,17 @@ def sample_pdf_file(tmp_path):
     pdf_path.write_bytes(b'%PDF-1.4')
     return str(pdf_path)
 
+@pytest.fixture
+def multi_page_pdf_file(tmp_path):
+    """Create a real three page PDF whose pages differ in width."""
+    pdf_path = tmp_path / "multi_page.pdf"
+    with fitz.open() as doc:
+        for width in (100, 120, 140):
+            page = doc.new_page(width=width, height=100)
+            page.insert_text((10, 50), "Invoice")
+        doc.save(str(pdf_path))
+    return str(pdf_path)
+
 class TestImageQualityChecks:
     """Tests for image quality assessment functions."""
     
@@ -90,6 +115,7 @@ class TestImageQualityChecks:
         mock_ocr.return_value = {'conf': ['90', '85', '95']}
         result = check_ocr_confidence(sample_image_file)
         assert result == 'Good'
+        assert mock_ocr.call_args.kwargs['config'] == '--oem 1 --psm 6'
 
     @patch('pytesseract.image_to_data')
     def test_check_ocr_confidence_bad(self, mock_ocr, sample_image_file):
@@ -98,6 +124,43 @@ class TestImageQualityChecks:
         result = check_ocr_confidence(sample_image_file)
         assert result == 'Bad'
 
+    @patch('pytesseract.image_to_data')
+    def test_check_ocr_confidence_ignores_placeholders(self, mock_ocr, sample_image_file):
+        """Test -1 confidences of non-word boxes do not drag the average down."""
+        mock_ocr.return_value = {'conf': [-1, -1, -1, 12, 14]}
+        result = check_ocr_confidence(sample_image_file)
+        assert result == 'Good'
+
+    @patch('pytesseract.image_to_data')
+    def test_check_ocr_confidence_from_array(self, mock_ocr, sample_image):
+        """Test OCR confidence can be checked on an in-memory array."""
+        mock_ocr.return_value = {'conf': ['90', '85', '95']}
+        result = check_ocr_confidence(sample_image)
+        assert result == 'Good'
+        assert isinstance(mock_ocr.call_args.args[0], Image.Image)
+
+    def test_check_image_quality_from_array(self):
+        """Test overall image quality check on an in-memory RGB array."""
+        rgb_page = np.full((10, 10, 3), 255, dtype=np.uint8)
+        with patch('src.api_client.check_focus_measure', return_value='Good') as mock_focus, \
+             patch('src.api_client.check_histogram_spread', return_value='Good'), \
+             patch('src.api_client.check_ocr_confidence', return_value='Good') as mock_ocr:
+            result = check_image_quality(rgb_page)
+            assert result == 'Good'
+            assert mock_focus.call_args.args[0].shape == (10, 10)
+            assert mock_ocr.call_args.args[0].shape == (10, 10)
+
+    def test_check_image_quality_downsamples_large_images(self):
+        """Test focus and histogram checks run on a downsampled copy of large images."""
+        gray_photo = np.zeros((4000, 3000), dtype=np.uint8)
+        with patch('src.api_client.check_focus_measure', return_value='Good') as mock_focus, \
+             patch('src.api_client.check_histogram_spread', return_value='Good') as mock_hist, \
+             patch('src.api_client.check_ocr_confidence', return_value='Good') as mock_ocr:
+            assert check_image_quality(gray_photo) == 'Good'
+            assert mock_focus.call_args.args[0].shape == (1024, 768)
+            assert mock_hist.call_args.args[0] is mock_focus.call_args.args[0]
+            assert mock_ocr.call_args.args[0].shape == (4000, 3000)
+
     def test_check_image_quality_all_good(self, sample_image_file):
         """Test overall image quality check when all metrics are good."""
         with patch('src.api_client.check_focus_measure', return_value='Good'), \
@@ -114,6 +177,16 @@ class TestImageQualityChecks:
             result = check_image_quality(sample_image_file)
             assert result == 'Bad'
 
+    def test_check_image_quality_skips_ocr_after_failure(self, sample_image_file):
+        """Test OCR is not run once a cheaper check has failed."""
+        with patch('src.api_client.check_focus_measure', return_value='Bad'), \
+             patch('src.api_client.check_histogram_spread') as mock_histogram, \
+             patch('src.api_client.check_ocr_confidence') as mock_ocr:
+            result = check_image_quality(sample_image_file)
+            assert result == 'Bad'
+            mock_histogram.assert_not_called()
+            mock_ocr.assert_not_called()
+
 class TestFileProcessing:
     """Tests for file processing functions."""
 
@@ -136,6 +209,7 @@ class TestFileProcessing:
             mock_pixmap.samples = rgb_data
             mock_pixmap.width = width
             mock_pixmap.height = height
+            mock_pixmap.tobytes.return_value = b'jpeg data'
             mock_page.get_pixmap.return_value = mock_pixmap
             pages.append(mock_page)
         
@@ -147,10 +221,10 @@ class TestFileProcessing:
         save_dir = os.path.join(str(tmp_path), "test_pdf")
         os.makedirs(save_dir, exist_ok=True)
         
-        with patch('PIL.Image.frombytes', return_value=Image.new('RGB', (100, 100))):
-            result = convert_pdf_to_images('dummy.pdf', save_dir)
-            assert len(result) == 2
-            assert all(isinstance(img, Image.Image) for img in result)
+        result = convert_pdf_to_images('dummy.pdf', save_dir)
+        assert len(result) == 2
+        assert all(isinstance(img, np.ndarray) for img in result)
+        assert all(img.shape == (100, 100, 3) for img in result)
 
     def test_encode_image_to_base64_success(self):
         """Test successful image to base64 encoding."""
@@ -165,6 +239,11 @@ class TestFileProcessing:
         except Exception:
             assert False, "Invalid base64 output"
 
+    def test_encode_bytes_to_base64(self):
+        """Test encoding raw JPEG bytes without re-encoding the image."""
+        raw = b'\xff\xd8\xff\xe0 jpeg data'
+        assert base64.b64decode(encode_bytes_to_base64(raw)) == raw
+
     def test_get_media_type(self):
         """Test media type detection for different file types."""
         assert get_media_type('test.jpg') == 'image/jpeg'
@@ -177,13 +256,23 @@ class TestFileProcessing:
         """Test saving image as JPEG."""
         output_path = tmp_path / "test_output.jpg"
         img = Image.new('RGBA', (10, 10), color='red')
-        save_image_as_jpeg(img, str(output_path))
+        jpeg_bytes = save_image_as_jpeg(img, str(output_path))
         assert output_path.exists()
+        assert output_path.read_bytes() == jpeg_bytes
         # Verify it's a valid JPEG
         saved_img = Image.open(str(output_path))
         assert saved_img.format == 'JPEG'
         assert saved_img.mode == 'RGB'  # Should have been converted from RGBA
 
+    def test_save_pixmap_as_jpeg(self, tmp_path):
+        """Test saving a PyMuPDF pixmap directly as JPEG."""
+        output_path = tmp_path / "test_pixmap.jpg"
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 10, 10), False)
+        pix.clear_with(255)
+        jpeg_bytes = save_pixmap_as_jpeg(pix, str(output_path))
+        assert output_path.read_bytes() == jpeg_bytes
+        assert Image.open(str(output_path)).format == 'JPEG'
+
 class TestAPIInteraction:
     """Tests for API interaction functions."""
 
@@ -192,6 +281,8 @@ class TestAPIInteraction:
         assert exponential_backoff(0) == 6  # First retry
         assert exponential_backoff(1) == 12  # Second retry
         assert exponential_backoff(2) == 24  # Third retry
+        assert exponential_backoff(3) == 48  # Fourth retry
+        assert exponential_backoff(4) == 60  # Capped from here on
         assert exponential_backoff(5) == 60  # Should be capped at 60
 
     @patch('anthropic.Anthropic')
@@ -209,6 +300,18 @@ class TestAPIInteraction:
         result, _ = communicate_with_api(image_data)
         assert result == "Contract_Payment"
 
+    @patch('anthropic.Anthropic')
+    def test_communicate_with_api_timeout(self, mock_anthropic):
+        """Test the request timeout is handed to the SDK call."""
+        mock_client = Mock()
+        mock_client.messages.create.return_value.model_dump_json.return_value = json.dumps({
+            'content': [{'text': '{"ContentType": "Contract_Payment"}'}]
+        })
+        mock_anthropic.return_value = mock_client
+
+        communicate_with_api([], timeout=30)
+        assert mock_client.messages.create.call_args.kwargs['timeout'] == 30
+
     @patch('anthropic.Anthropic')
     def test_communicate_with_api_rate_limit(self, mock_anthropic):
         """Test API rate limit handling."""
@@ -241,6 +344,28 @@ class TestAPIInteraction:
             assert content_type is None
             assert error_msg == "API communication failed after maximum retries"
 
+    @pytest.mark.parametrize("headers,expected_wait", [
+        ({"retry-after": "5"}, 5),
+        ({}, 12),  # No header: exponential backoff for the second attempt
+        ({"retry-after": "3600"}, 60),  # Capped so the run is not stalled
+        ({"retry-after": "-5"}, 0),
+        ({"retry-after": "nan"}, 12),  # Unusable: falls back to backoff
+        ({"retry-after": "inf"}, 60),
+    ])
+    def test_handle_api_error_wait_time(self, headers, expected_wait):
+        """Test the server's retry-after header takes precedence over exponential backoff."""
+        mock_response = Mock(status_code=429, headers=headers)
+        error = APIStatusError(message="Rate limit exceeded", response=mock_response, body=None)
+        with patch('time.sleep') as mock_sleep:
+            assert handle_api_error(error, attempt=1) is True
+            mock_sleep.assert_called_once_with(expected_wait)
+
+    @patch('anthropic.Anthropic')
+    def test_get_anthropic_client_is_cached(self, mock_anthropic):
+        """Test the API client is built once and reused across calls."""
+        assert get_anthropic_client() is get_anthropic_client()
+        mock_anthropic.assert_called_once()
+
     def test_parse_api_response_success(self):
         """Test successful API response parsing."""
         response_data = {
@@ -260,16 +385,43 @@ class TestAPIInteraction:
 class TestFileProcessingPipeline:
     """Tests for complete file processing pipeline."""
 
-    def test_process_file_for_api_pdf(self, sample_pdf_file, tmp_path):
+    def test_process_file_for_api_pdf(self, multi_page_pdf_file, tmp_path):
         """Test processing PDF file."""
-        with patch('src.api_client.convert_pdf_to_images') as mock_convert, \
-             patch('src.api_client.check_image_quality', return_value='Good'):
-            mock_convert.return_value = [Image.new('RGB', (10, 10), color='red')]
-            result = process_file_for_api(sample_pdf_file, str(tmp_path))
+        with patch('src.api_client.check_image_quality', return_value='Good'):
+            result = process_file_for_api(multi_page_pdf_file, str(tmp_path))
             assert isinstance(result, list)
-            assert len(result) > 0
+            assert len(result) == 3
             assert all('type' in item for item in result)
 
+    def test_process_file_for_api_pdf_mixed_quality(self, multi_page_pdf_file, tmp_path):
+        """Test pages are checked in grayscale and only good pages are rendered and sent, in page order."""
+        checked_shapes = []
+
+        def fake_quality(page):
+            checked_shapes.append(page.shape)
+            return 'Bad' if page.shape[1] == 120 else 'Good'
+
+        with patch('src.api_client.check_image_quality', side_effect=fake_quality):
+            result = process_file_for_api(multi_page_pdf_file, str(tmp_path))
+
+        assert sorted(checked_shapes) == [(100, 100), (100, 120), (100, 140)]
+        assert len(result) == 2
+        sent_widths = [Image.open(io.BytesIO(base64.b64decode(item['source']['data']))).size[0] for item in result]
+        assert sent_widths == [100, 140]
+        # Every page is still saved locally
+        assert len(os.listdir(tmp_path / 'multi_page')) == 3
+
+    def test_process_file_for_api_pdf_unreadable(self, sample_pdf_file, tmp_path):
+        """Test an unreadable PDF is reported as poor quality."""
+        assert process_file_for_api(sample_pdf_file, str(tmp_path)) == "Unclassified - Poor image quality"
+
+    def test_classify_file_pdf_quality_check_error(self, multi_page_pdf_file, tmp_path, monkeypatch):
+        """Test a failing quality check is raised instead of classifying the PDF as poor quality."""
+        monkeypatch.chdir(tmp_path)  # classify_file saves pages under a relative data directory
+        with patch('src.api_client.check_image_quality', side_effect=pytesseract.TesseractNotFoundError()):
+            with pytest.raises(pytesseract.TesseractNotFoundError):
+                classify_file(multi_page_pdf_file)
+
     def test_process_file_for_api_image(self, sample_image_file, tmp_path):
         """Test processing image file."""
         with patch('src.api_client.check_image_quality', return_value='Good'):
@@ -2,12 +2,11 @@ import os
 import pytest
 import shutil
 from unittest.mock import patch, Mock
-import subprocess
 from pathlib import Path
 import tempfile
 from datetime import datetime
 
-from src.file_utils import find_file_path, rename_file, validate_new_filename
+from src.file_utils import find_file_path, rename_file, validate_new_filename, _find_deal_folders
 
 @pytest.fixture
 def test_directory():
@@ -39,123 +38,95 @@ def sample_files(test_directory):
     
     return created_files
 
+@pytest.fixture
+def share_roots(test_directory):
+    """Create empty Deals and Accounts roots mirroring the file share layout."""
+    deals_path = os.path.join(test_directory, "Deals")
+    accounts_path = os.path.join(test_directory, "Accounts")
+    os.makedirs(deals_path)
+    os.makedirs(accounts_path)
+    return deals_path, accounts_path
+
+def create_file(folder, file_name):
+    os.makedirs(folder, exist_ok=True)
+    file_path = os.path.join(folder, file_name)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("Test content")
+    return file_path
+
 class TestFindFilePath:
     """Tests for find_file_path function."""
 
-    def test_find_existing_file(self, test_directory):
+    def test_find_existing_file(self, share_roots):
         """Test finding an existing file in the deals directory."""
-        expected_path = os.path.join(test_directory, 'test_deal', 'test.pdf')
-        with patch('subprocess.run') as mock_run:
-            mock_result = Mock()
-            # Simulate exact PowerShell script output
-            mock_result.stdout = (
-                f"Searching for file: test.pdf\n"
-                f"In folder: test_deal\n"
-                f"Locations to search: Z:\\Zoho CRM\\Deals, Z:\\Zoho CRM\\Accounts\n"
-                f"File found: {expected_path}\n"
-                f"RESULT:{expected_path}\n"
-                f"Search completed in 0.1234 seconds.\n"  # Added newline
-            )
-            mock_result.returncode = 0
-            mock_run.return_value = mock_result
-            
-            # Mock os.path.exists to return True for the expected path
-            with patch('os.path.exists', return_value=True):  # Added this patch
-                result = find_file_path("test_deal", "test.pdf")
-                assert result is not None
-                assert result == expected_path
+        deals_path, accounts_path = share_roots
+        expected_path = create_file(os.path.join(deals_path, "test_deal"), "test.pdf")
+
+        result = find_file_path("test_deal", "test.pdf", deals_path=deals_path, accounts_path=accounts_path)
+        assert result == expected_path
+
+    def test_find_file_in_account_associated_deals(self, share_roots):
+        """Test falling back to an account's Associated Deals folder."""
+        deals_path, accounts_path = share_roots
+        expected_path = create_file(
+            os.path.join(accounts_path, "Company", "Associated Deals", "test_deal"), "test.pdf")
+
+        result = find_file_path("test_deal", "test.pdf", deals_path=deals_path, accounts_path=accounts_path)
+        assert result == expected_path
 
-    def test_file_not_found(self):
+    def test_file_not_found(self, share_roots):
         """Test behavior when file is not found."""
-        with patch('subprocess.run') as mock_run:
-            mock_result = Mock()
-            mock_result.stdout = (
-                "Searching for file: nonexistent.pdf\n"
-                "In folder: nonexistent_deal\n"
-                "Locations to search: Z:\\Zoho CRM\\Deals, Z:\\Zoho CRM\\Accounts\n"
-                "File not found in any of the specified locations.\n"
-                "RESULT:NOT_FOUND\n"
-                "Search completed in 0.1234 seconds."
-            )
-            mock_result.returncode = 0
-            mock_run.return_value = mock_result
-
-            result = find_file_path("nonexistent_deal", "nonexistent.pdf")
-            assert result is None
-
-    def test_powershell_error(self):
-        """Test handling of PowerShell script errors."""
-        with patch('subprocess.run') as mock_run:
-            mock_run.side_effect = subprocess.CalledProcessError(1, 'cmd', "Error")
-            result = find_file_path("test_deal", "test.pdf")
-            assert result is None
-
-    @pytest.mark.parametrize("deal_name,file_name,expected_path", [
-        (
-            "deal with spaces",
-            "file with spaces.pdf",
-            "Z:\\Zoho CRM\\Deals\\deal with spaces\\file with spaces.pdf"
-        ),
-        (
-            "deal_normal",
-            "file!@#$.pdf",
-            "Z:\\Zoho CRM\\Deals\\deal_normal\\file!@#$.pdf"
-        ),
-        (
-            "déàl",
-            "fïlé.pdf",
-            "Z:\\Zoho CRM\\Deals\\déàl\\fïlé.pdf"
-        ),
+        deals_path, accounts_path = share_roots
+        result = find_file_path("nonexistent_deal", "nonexistent.pdf", initial_delay=0,
+                                deals_path=deals_path, accounts_path=accounts_path)
+        assert result is None
+
+    def test_deal_folders_resolved_once(self, share_roots):
+        """Test several files of one deal reuse the cached folder resolution."""
+        deals_path, accounts_path = share_roots
+        deal_folder = os.path.join(accounts_path, "Company", "Associated Deals", "test_deal")
+        first = create_file(deal_folder, "first.pdf")
+        second = create_file(deal_folder, "second.pdf")
+
+        with patch('src.file_utils._find_deal_folders', wraps=_find_deal_folders) as mock_resolve:
+            _find_deal_folders.cache_clear()
+            assert find_file_path("test_deal", "first.pdf", deals_path=deals_path, accounts_path=accounts_path) == first
+            assert find_file_path("test_deal", "second.pdf", deals_path=deals_path, accounts_path=accounts_path) == second
+            assert mock_resolve.call_count == 2
+            assert _find_deal_folders.cache_info().hits == 1
+
+    def test_colon_matches_any_character(self, share_roots):
+        """Test a ':' in the stored name matches the character it was replaced with on disk."""
+        deals_path, accounts_path = share_roots
+        expected_path = create_file(os.path.join(deals_path, "test_deal"), "invoice_2024.pdf")
+
+        result = find_file_path("test_deal", "invoice:2024.pdf", deals_path=deals_path, accounts_path=accounts_path)
+        assert result == expected_path
+
+    @pytest.mark.parametrize("deal_name,file_name", [
+        ("deal with spaces", "file with spaces.pdf"),
+        ("deal_normal", "file!@#$.pdf"),
+        ("deal_brackets", "file [1].pdf"),
+        ("déàl", "fïlé.pdf"),
     ])
-    def test_special_characters(self, deal_name, file_name, expected_path):
+    def test_special_characters(self, share_roots, deal_name, file_name):
         """Test handling of special characters in file and deal names."""
-        with patch('subprocess.run') as mock_run:
-            mock_result = Mock()
-            # Match PowerShell script output format exactly
-            mock_result.stdout = (
-                f"Searching for file: {file_name}\n"
-                f"In folder: {deal_name}\n"
-                f"Locations to search: Z:\\Zoho CRM\\Deals, Z:\\Zoho CRM\\Accounts\n"
-                f"File found: {expected_path}\n"
-                f"RESULT:{expected_path}\n"
-                f"Search completed in 0.1234 seconds.\n"  # Added newline
-            )
-            mock_result.returncode = 0
-            mock_run.return_value = mock_result
-
-            # Mock os.path.exists to return True for the expected path
-            with patch('os.path.exists', return_value=True):  # Added this patch
-                result = find_file_path(deal_name, file_name)
-                assert result is not None
-                assert result == expected_path
-
-    def test_retry_on_timeout(self):
-        """Test retry mechanism on temporary failures."""
-        expected_path = "Z:\\Zoho CRM\\Deals\\test_deal\\test.pdf"
-        with patch('subprocess.run') as mock_run:
-            mock_result = Mock()
-            mock_result.stdout = (
-                f"Searching for file: test.pdf\n"
-                f"In folder: test_deal\n"
-                f"Locations to search: Z:\\Zoho CRM\\Deals, Z:\\Zoho CRM\\Accounts\n"
-                f"File found: {expected_path}\n"
-                f"RESULT:{expected_path}\n"
-                f"Search completed in 0.1234 seconds.\n"
-            )
-            mock_result.returncode = 0
-            
-            # Simulate timeout then success
-            mock_run.side_effect = [
-                subprocess.TimeoutExpired(['powershell.exe'], 30),
-                mock_result  # Return success on second attempt
-            ]
-
-            # Mock os.path.exists to return True for the expected path
-            with patch('os.path.exists', return_value=True):
-                result = find_file_path("test_deal", "test.pdf")
-                assert result is not None
-                assert result == expected_path
-                assert mock_run.call_count == 2
+        deals_path, accounts_path = share_roots
+        expected_path = create_file(os.path.join(deals_path, deal_name), file_name)
+
+        result = find_file_path(deal_name, file_name, deals_path=deals_path, accounts_path=accounts_path)
+        assert result == expected_path
+
+    def test_retry_on_transient_error(self, share_roots):
+        """Test retry mechanism on temporary share failures."""
+        deals_path, accounts_path = share_roots
+        os.makedirs(os.path.join(deals_path, "test_deal"))
+        expected_path = os.path.join(deals_path, "test_deal", "test.pdf")
+        with patch('src.file_utils._search_folder', side_effect=[OSError("Share unavailable"), expected_path]) as mock_search, \
+             patch('time.sleep'):
+            result = find_file_path("test_deal", "test.pdf", deals_path=deals_path, accounts_path=accounts_path)
+            assert result == expected_path
+            assert mock_search.call_count == 2
 
 class TestRenameFile:
     """Tests for rename_file function."""
@@ -197,6 +168,23 @@ class TestRenameFile:
         assert os.path.exists(new_path)
         assert "target (1).pdf" in new_path
 
+    def test_rename_never_overwrites_existing_file(self, test_directory):
+        """Test an existing file with the classified name is kept and a counter is added."""
+        original_path = os.path.join(test_directory, "scan.pdf")
+        existing_path = os.path.join(test_directory, "Rental_Contract.pdf")
+        for path, content in [(original_path, "scan"), (existing_path, "existing")]:
+            with open(path, "w") as f:
+                f.write(content)
+
+        success, new_path = rename_file(original_path, "Rental_Contract")
+
+        assert success
+        assert os.path.basename(new_path) == "Rental_Contract (1).pdf"
+        with open(existing_path) as f:
+            assert f.read() == "existing"
+        with open(new_path) as f:
+            assert f.read() == "scan"
+
     def test_rename_with_special_characters(self, test_directory):
         """Test renaming with special characters in filename."""
         original_path = os.path.join(test_directory, "original.pdf")
@@ -216,37 +204,28 @@ class TestRenameFile:
         with open(original_path, "w") as f:
             f.write("test content")
 
-        # Mock os.rename to raise PermissionError
-        with patch('os.rename') as mock_rename:
+        # Mock os.replace to raise PermissionError
+        with patch('os.replace') as mock_rename:
             mock_rename.side_effect = PermissionError("Permission denied")
             success, error_msg = rename_file(original_path, "new.pdf")
             
             assert not success
             assert "Permission denied" in error_msg
-    
-    def test_command_construction(self):
-        """Test that the PowerShell command is constructed correctly."""
-        with patch('subprocess.run') as mock_run:
-            mock_result = Mock()
-            mock_result.stdout = "RESULT:NOT_FOUND"
-            mock_result.returncode = 0
-            mock_run.return_value = mock_result
-
-            find_file_path("test_deal", "test.pdf")
-
-            # Verify the command construction
-            mock_run.assert_called_with(
-                [
-                    'powershell.exe',
-                    '-ExecutionPolicy', 'Bypass',
-                    '-File', 'tools\\findFilepath.ps1',
-                    '-FileName', 'test.pdf',
-                    '-FolderName', 'test_deal'
-                ],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            # The placeholder claimed for the new name is cleaned up
+            assert os.listdir(test_directory) == ["original.pdf"]
+
+    def test_rename_permission_error_cleanup_fails(self, test_directory):
+        """Test the original error is reported when removing the placeholder also fails."""
+        original_path = os.path.join(test_directory, "original.pdf")
+        with open(original_path, "w") as f:
+            f.write("test content")
+
+        with patch('os.replace', side_effect=PermissionError("Permission denied")), \
+             patch('os.remove', side_effect=OSError("Device busy")):
+            success, error_msg = rename_file(original_path, "new.pdf")
+
+        assert not success
+        assert "Permission denied" in error_msg
 
 class TestValidateNewFilename:
     """Tests for validate_new_filename function."""
@@ -2,13 +2,14 @@ import pytest
 import os
 import logging
 import tempfile
-from unittest.mock import Mock, patch, MagicMock, call, mock_open
+from unittest.mock import Mock, patch, MagicMock, call
 from datetime import datetime
+from dataclasses import dataclass, replace
+from contextlib import ExitStack
 import json
 import sys
 from pathlib import Path
 import pyodbc
-from azure.identity import DefaultAzureCredential
 
 # Add the src directory to the Python path
 sys.path.append(str(Path(__file__).parent.parent))
@@ -21,7 +22,7 @@ from src.main import (
     acquire_lock,
     release_lock,
     LockError,
-    generate_new_filename
+    parse_args
 )
 
 @pytest.fixture
@@ -35,27 +36,38 @@ def mock_config():
         "processing_timeout": 300
     }
 
-@pytest.fixture
+@dataclass(frozen=True)
+class FakeRecord:
+    """Plain stand-in for a contract_payments row; process_failed_record only reads it."""
+    contract_payments_id: int = 1
+    deal_name: str = "test_deal"
+    file_name: str = "test_file.pdf"
+    full_file_path: str = "/path/to/test_file.pdf"
+    deal_id: int = 100
+    status: str = "Failed"
+    failure_reason: str = "File pattern does not match required format"
+
+@pytest.fixture(scope="module")
 def mock_record():
-    record = Mock()
-    record.contract_payments_id = 1
-    record.deal_name = "test_deal"
-    record.file_name = "test_file.pdf"
-    record.full_file_path = "/path/to/test_file.pdf"
-    record.deal_id = 100
-    record.status = "Failed"
-    record.failure_reason = "File pattern does not match required format"
-    return record
+    return FakeRecord()
 
 @pytest.fixture
-def mock_db_connection():
-    conn = Mock()
-    cursor = Mock()
-    conn.cursor.return_value = cursor
-    return conn
+def existing_record(mock_record, tmp_path):
+    """mock_record pointing at a file that really exists, so no path check has to be patched."""
+    file_path = tmp_path / mock_record.file_name
+    file_path.write_text("Test content")
+    return replace(mock_record, full_file_path=str(file_path))
+
+@pytest.fixture(autouse=True)
+def saved_images_dir(tmp_path, monkeypatch):
+    """Keeps process_failed_record from creating data/saved_images in the checkout."""
+    saved_images = tmp_path / "saved_images"
+    monkeypatch.setattr('src.main.SAVED_IMAGES_DIR', str(saved_images))
+    return saved_images
 
 class TestConfigurationLoading:
-    def test_load_config_success(self, tmp_path):
+    # load_config reads data/config.json relative to the working directory
+    def test_load_config_success(self, tmp_path, monkeypatch):
         """Test successful configuration loading"""
         config_data = {
             "azure_sql_server": "test-server",
@@ -65,25 +77,27 @@ class TestConfigurationLoading:
         }
         config_file = tmp_path / "data" / "config.json"
         config_file.parent.mkdir(exist_ok=True)
-        with open(config_file, 'w') as f:
-            json.dump(config_data, f)
+        config_file.write_text(json.dumps(config_data))
+        monkeypatch.chdir(tmp_path)
 
-        with patch('builtins.open', mock_open(read_data=json.dumps(config_data))):
-            config = load_config()
-            assert config == config_data
-            assert all(key in config for key in ["azure_sql_server", "azure_sql_database", "log_directory"])
+        config = load_config()
+        assert config == config_data
+        assert all(key in config for key in ["azure_sql_server", "azure_sql_database", "log_directory"])
 
-    def test_load_config_missing_file(self):
+    def test_load_config_missing_file(self, tmp_path, monkeypatch):
         """Test handling of missing configuration file"""
-        with patch('builtins.open', side_effect=FileNotFoundError):
-            with pytest.raises(FileNotFoundError):
-                load_config()
+        monkeypatch.chdir(tmp_path)
+        with pytest.raises(FileNotFoundError):
+            load_config()
 
-    def test_load_config_invalid_json(self, tmp_path):
+    def test_load_config_invalid_json(self, tmp_path, monkeypatch):
         """Test handling of invalid JSON in config file"""
-        with patch('builtins.open', mock_open(read_data="invalid json")):
-            with pytest.raises(json.JSONDecodeError):
-                load_config()
+        config_file = tmp_path / "data" / "config.json"
+        config_file.parent.mkdir()
+        config_file.write_text("invalid json")
+        monkeypatch.chdir(tmp_path)
+        with pytest.raises(json.JSONDecodeError):
+            load_config()
 
 class TestLoggingSetup:
     def test_setup_logging_directory_creation(self, tmp_path):
@@ -140,44 +154,26 @@ class TestLoggingSetup:
         assert actual_files == expected_files
 
 class TestRecordProcessing:
-    def test_process_failed_record_file_not_found(self, mock_db_connection, mock_record):
-        """Test handling of missing files"""
-        with patch('os.path.exists', return_value=False), \
-             patch('src.main.find_file_path', return_value=None):
+    @pytest.mark.parametrize("exists,patches,expected", [
+        (False, {'src.main.find_file_path': None}, "File not found"),
+        (True, {'src.main.classify_file': ("Rental_Contract", "response"),
+                'src.main.rename_file': (False, "Access denied")}, "Access denied"),
+    ], ids=["file_not_found", "rename_error"])
+    def test_process_failed_record(self, mock_db_connection, request,
+                                   exists, patches, expected):
+        """Test missing files and rename errors are recorded with their reason"""
+        # A missing file is simply one whose stored path does not exist
+        record = request.getfixturevalue("existing_record" if exists else "mock_record")
+        with ExitStack() as stack:
+            for target, return_value in patches.items():
+                stack.enter_context(patch(target, return_value=return_value))
             
-            process_failed_record(mock_db_connection, mock_record)
-            
-            # Verify error handling in the execute call args
-            args = mock_db_connection.cursor().execute.call_args_list
-            has_error_msg = any("File not found" in str(call_args) for call_args in args)
-            assert has_error_msg
-
-    def test_process_failed_record_rename_error(self, mock_db_connection, mock_record):
-        """Test handling of file rename errors"""
-        with patch('os.path.exists', return_value=True), \
-             patch('src.main.validate_new_filename', return_value=(True, "")), \
-             patch('src.main.check_duplicate_filename', return_value=False), \
-             patch('src.main.rename_file', return_value=(False, "Access denied")):
-            
-            process_failed_record(mock_db_connection, mock_record)
+            process_failed_record(mock_db_connection, record)
             
-            # Verify error handling in the execute call args
-            args = mock_db_connection.cursor().execute.call_args_list
-            has_error_msg = any("Access denied" in str(call_args) for call_args in args)
-            assert has_error_msg
-
-    def test_process_failed_record_duplicate_filename(self, mock_db_connection, mock_record):
-        """Test handling of duplicate filenames"""
-        with patch('os.path.exists', return_value=True), \
-             patch('src.main.validate_new_filename', return_value=(True, "")), \
-             patch('src.main.check_duplicate_filename', return_value=True):
-            
-            process_failed_record(mock_db_connection, mock_record)
-            
-            # Verify error handling in all execute calls
-            args = mock_db_connection.cursor().execute.call_args_list
-            has_error_msg = any("Duplicate filename" in str(call_args) for call_args in args)
-            assert has_error_msg
+        # Verify error handling in the execute call args
+        args = mock_db_connection.cursor().execute.call_args_list
+        has_error_msg = any(expected in str(call_args) for call_args in args)
+        assert has_error_msg
 
 class TestMainFunction:
     @patch('src.main.connect_to_azure_db')
@@ -204,7 +200,7 @@ class TestMainFunction:
             mock_conn.close.assert_called_once()
             
             # Verify proper logging
-            mock_get_records.assert_called_once_with(mock_conn)
+            mock_get_records.assert_called_once_with(mock_conn, batch_size=50)
             assert not os.path.exists(lock_file), "Lock file should be released"
 
     @patch('src.main.connect_to_azure_db')
@@ -229,6 +225,21 @@ class TestMainFunction:
         assert mock_process_record.call_count == len(mock_records)
         mock_conn.close.assert_called_once()
 
+class TestArgumentParsing:
+    def test_parse_args_default_batch_size(self):
+        """Test the batch size defaults to 50 when no flag is given"""
+        assert parse_args([]).batch_size == 50
+
+    def test_parse_args_batch_size(self):
+        """Test the batch size can be set from the command line"""
+        assert parse_args(['--batch-size', '10']).batch_size == 10
+
+    @pytest.mark.parametrize("value", ["0", "-1", "ten"])
+    def test_parse_args_rejects_invalid_batch_size(self, value):
+        """Test the batch size must be a positive integer"""
+        with pytest.raises(SystemExit):
+            parse_args(['--batch-size', value])
+
 class TestErrorHandling:
     def test_process_failed_record_database_error(self, mock_db_connection, mock_record):
         """Test handling of database errors during record processing"""
@@ -237,16 +248,15 @@ class TestErrorHandling:
         mock_cursor.execute.side_effect = pyodbc.Error('Database error')
         mock_db_connection.cursor.return_value = mock_cursor
         
-        with patch('os.path.exists', return_value=True):
-            try:
+        # mock_record's file does not exist, so the first write is the failure update
+        with patch('src.main.find_file_path', return_value=None):
+            with pytest.raises(pyodbc.Error):
                 process_failed_record(mock_db_connection, mock_record)
-            except pyodbc.Error:
-                pass  # Expected exception
             
-            # Verify rollback was called
-            mock_db_connection.rollback.assert_called_once()
+            # Both the failed update and the error handler's retry of it were rolled back
+            assert mock_db_connection.rollback.call_count == 2
 
-    def test_process_failed_record_filesystem_error(self, mock_db_connection, mock_record):
+    def test_process_failed_record_filesystem_error(self, mock_db_connection, existing_record):
         """Test handling of filesystem errors during record processing"""
         mock_cursor = Mock()
         mock_db_connection.cursor.return_value = mock_cursor
@@ -258,12 +268,10 @@ class TestErrorHandling:
                 assert "Permission denied" in args[1][2]  # Check failure reason parameter
         mock_cursor.execute.side_effect = mock_execute
         
-        with patch('os.path.exists', return_value=True), \
-             patch('src.main.rename_file', side_effect=OSError("Permission denied")), \
-             patch('src.main.validate_new_filename', return_value=(True, "")), \
-             patch('src.main.check_duplicate_filename', return_value=False):
+        with patch('src.main.classify_file', return_value=("Rental_Contract", "response")), \
+             patch('src.main.rename_file', side_effect=OSError("Permission denied")):
 
-            process_failed_record(mock_db_connection, mock_record)
+            process_failed_record(mock_db_connection, existing_record)
             
             # Verify execute was called
             mock_cursor.execute.assert_called()
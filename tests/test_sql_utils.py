@@ -1,4 +1,6 @@
-from src.sql_utils import get_failed_unprocessed_records, update_renamed_record
+from src.sql_utils import (
+    get_failed_unprocessed_records, update_renamed_record, check_duplicate_filename
+)
 
 def test_get_failed_unprocessed_records(mock_db_connection):
     def test_retrieval():
@@ -11,4 +13,15 @@ def test_get_failed_unprocessed_records(mock_db_connection):
 def test_update_renamed_record(mock_db_connection):
     def test_successful_update():
         update_renamed_record(mock_db_connection, 1, "new.pdf", "/new/path")
-        mock_db_connection.commit.assert_called_once()
\ No newline at end of file
+        mock_db_connection.commit.assert_called_once()
+
+def test_check_duplicate_filename(mock_db_connection):
+    cursor = mock_db_connection.cursor()
+    cursor.fetchval.return_value = 1
+    assert check_duplicate_filename(mock_db_connection, "new.pdf", 7)
+    sql, params = cursor.execute.call_args[0]
+    assert "EXISTS" in sql
+    assert params == ("new.pdf", 7)
+
+    cursor.fetchval.return_value = 0
+    assert not check_duplicate_filename(mock_db_connection, "new.pdf", 7)